@@ -1,48 +1,218 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 import os
+import json
+import hashlib
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 import random
 import time
 import asyncio
+import orjson
+import redis.asyncio as aioredis
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncMongoClient(
+    mongo_url,
+    minPoolSize=10,
+    maxPoolSize=50,
+    serverSelectionTimeoutMS=2000,
+    waitQueueTimeoutMS=1000
+)
 db = client[os.environ['DB_NAME']]
 
+# Serves get_chat_history's session_id match + timestamp sort from the index
+CHAT_HISTORY_INDEX = [("session_id", 1), ("timestamp", 1)]
+
+# Optional Redis cache for session reads; disabled when REDIS_URL is unset.
+# Every invalidation also stamps the session with a fresh generation token,
+# and load_session only writes a document back if the token is unchanged
+# since its read, so a find_one that raced an update can't re-cache it.
+SESSION_CACHE_TTL = 30
+# Seconds before a Redis call gives up. The flusher and chat await
+# invalidation before replying, so a stalled Redis must time out rather than
+# block them; cache errors are only logged, and SESSION_CACHE_TTL bounds a
+# missed delete.
+REDIS_TIMEOUT = 0.3
+redis_url = os.environ.get('REDIS_URL')
+_redis = aioredis.from_url(
+    redis_url,
+    socket_timeout=REDIS_TIMEOUT,
+    socket_connect_timeout=REDIS_TIMEOUT
+) if redis_url else None
+# KEYS: session, generation; ARGV: generation seen at read, ttl, document
+_cache_session = _redis.register_script("""
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] then
+    redis.call('SETEX', KEYS[1], ARGV[2], ARGV[3])
+end
+""") if _redis is not None else None
+
+# Artificial delay (seconds) for the mock verification APIs; off unless set
+_SIMULATE = float(os.environ.get("SIMULATE_DELAY", "0"))
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Batched writes: handlers queue chat inserts and session updates here and a
+# background task flushes them every few milliseconds as one insert_many and
+# one bulk_write, instead of a database round-trip per write.
+FLUSH_INTERVAL = 0.005
+_pending_msgs: list = []
+_pending_updates: list = []
+_pending_futures: list = []
+_pending_session_ids: set = set()
+_flush_task: Optional[asyncio.Task] = None
+_inline_flush: Optional[asyncio.Task] = None
+_flushing = False
+
+def queue_message(message: dict):
+    _pending_msgs.append(message)
+    _flush_if_no_loop()
+
+def queue_session_update(session_id: str, fields: dict) -> asyncio.Future:
+    """Queue a $set on a session; the returned future resolves once it is written.
+
+    updated_at is stamped server-side with $$NOW. The update is a pipeline,
+    so field values are wrapped in $literal to keep strings such as "$x"
+    from being read as expressions.
+    """
+    update = {key: {"$literal": value} for key, value in fields.items()}
+    update["updated_at"] = "$$NOW"
+    _pending_updates.append(UpdateOne({"id": session_id}, [{"$set": update}]))
+    _pending_session_ids.add(session_id)
+    future = asyncio.get_running_loop().create_future()
+    _pending_futures.append(future)
+    _flush_if_no_loop()
+    return future
+
+def _flush_if_no_loop():
+    # Without the flush loop (app run without lifespan, or after shutdown)
+    # flush right away so awaited session updates can't hang
+    global _inline_flush
+    if not _flushing and (_inline_flush is None or _inline_flush.done()):
+        _inline_flush = asyncio.get_running_loop().create_task(_flush_until_empty())
+
+async def _flush_until_empty():
+    while _pending_msgs or _pending_updates:
+        try:
+            await flush_pending()
+        except Exception:
+            logger.exception("Batched write flush failed")
+
+async def flush_pending():
+    global _pending_msgs, _pending_updates, _pending_futures, _pending_session_ids
+    msgs, updates, futures = _pending_msgs, _pending_updates, _pending_futures
+    session_ids = _pending_session_ids
+    _pending_msgs, _pending_updates, _pending_futures = [], [], []
+    _pending_session_ids = set()
+    # The two collections are independent, so overlap their round-trips
+    insert = db.chat_messages.insert_many(msgs, ordered=False) if msgs else asyncio.sleep(0)
+    bulk = db.onboarding_sessions.bulk_write(updates, ordered=False) if updates else asyncio.sleep(0)
+    insert_result, bulk_result = await asyncio.gather(insert, bulk, return_exceptions=True)
+    if isinstance(insert_result, Exception):
+        # Transcript rows are fire-and-forget; don't fail unrelated session updates
+        logger.error("Failed to insert batched chat messages", exc_info=insert_result)
+    failed = {}
+    if isinstance(bulk_result, BulkWriteError) and not bulk_result.details.get("writeConcernErrors"):
+        # Unordered batch: only the updates listed in writeErrors failed
+        logger.error("Failed to write %d batched session updates", len(bulk_result.details["writeErrors"]))
+        for error in bulk_result.details["writeErrors"]:
+            failed[error["index"]] = OperationFailure(error["errmsg"], error["code"], error)
+    elif isinstance(bulk_result, Exception):
+        logger.error("Failed to write batched session updates", exc_info=bulk_result)
+        failed = dict.fromkeys(range(len(futures)), bulk_result)
+    # Drop cached sessions before waking the handlers
+    await invalidate_cached_sessions(session_ids)
+    for index, future in enumerate(futures):
+        if future.done():
+            continue
+        if index in failed:
+            future.set_exception(failed[index])
+        else:
+            future.set_result(None)
+
+async def load_session(session_id: str) -> Optional[dict]:
+    """Fetch a session without its _id, served from Redis when cached."""
+    key = f"session:{session_id}"
+    generation = None
+    if _redis is not None:
+        try:
+            raw, generation = await _redis.mget(key, f"{key}:gen")
+            generation = generation or b""
+        except Exception:
+            logger.warning("Session cache read failed; falling back to MongoDB", exc_info=True)
+            raw = generation = None
+        if raw:
+            return orjson.loads(raw)
+    session = await db.onboarding_sessions.find_one({"id": session_id}, projection={"_id": 0})
+    if session and generation is not None:
+        try:
+            await _cache_session(
+                keys=[key, f"{key}:gen"],
+                args=[generation, SESSION_CACHE_TTL, orjson.dumps(session)]
+            )
+        except Exception:
+            logger.warning("Session cache write failed", exc_info=True)
+    return session
+
+async def invalidate_cached_sessions(session_ids):
+    if _redis is None or not session_ids:
+        return
+    try:
+        async with _redis.pipeline(transaction=False) as pipe:
+            for sid in session_ids:
+                pipe.delete(f"session:{sid}")
+                pipe.set(f"session:{sid}:gen", uuid.uuid4().hex, ex=SESSION_CACHE_TTL)
+            await pipe.execute()
+    except Exception:
+        logger.warning("Session cache invalidation failed", exc_info=True)
+
+async def flush_loop():
+    while _flushing:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        if _pending_msgs or _pending_updates:
+            try:
+                await flush_pending()
+            except Exception:
+                # Keep the writer alive; later updates would otherwise hang
+                logger.exception("Batched write flush failed")
+
+_getrb = random.getrandbits
+
+def _now() -> datetime:
+    return datetime.fromtimestamp(time.time(), tz=timezone.utc)
+
 # Pydantic Models
 class OnboardingSession(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     customer_phone: Optional[str] = None
     customer_email: Optional[str] = None
     current_step: str = "welcome"
     progress_percentage: int = 0
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=_now)
+    updated_at: datetime = Field(default_factory=_now)
     status: str = "in_progress"
 
 class ChatMessage(BaseModel):
     session_id: str
     message: str
     sender: str  # "user" or "agent"
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=_now)
 
 class VerificationRequest(BaseModel):
     session_id: str
@@ -76,38 +246,122 @@ class ESignRequest(BaseModel):
     signature_data: str  # base64 encoded signature
 
 # Mock AI responses for different onboarding steps
+_RESPONSES: dict[str, str] = {
+    "welcome": "Hi there! I'm Boardy, your personal AI banking assistant! 👋 I'll help you complete your account opening in just a few simple steps. We'll verify your mobile number and email, then complete your KYC process. Ready to get started with me? 🚀",
+    
+    "phone_verification": "Great! Now I need to verify your mobile number. Please enter your 10-digit mobile number, and I'll send you an OTP for verification. 📱",
+    
+    "phone_otp_verification": "Perfect! I've sent a 6-digit OTP to your mobile number. Please enter the OTP you received. (For demo: use 123456) 🔢",
+    
+    "email_verification": "Excellent! Now let's verify your email address. Please provide your email ID, and I'll send you a verification code. 📧",
+    
+    "email_otp_verification": "Great! I've sent a 6-digit OTP to your email address. Please check your inbox and enter the OTP you received. (For demo: use 654321) 📧✨",
+    
+    "pan_verification": "Now let's start with your KYC verification. First, I need to verify your PAN card details. Please enter your 10-character PAN number. 🆔",
+    
+    "kyc_document": "Excellent! Your PAN is verified. Now please choose your preferred KYC method:\n\n🪪 **Aadhaar eKYC** - Quick verification using your Aadhaar number\n📄 **DigiLocker** - Upload documents from your DigiLocker\n\nYou can also upload documents directly for verification.",
+    
+    "face_verification": "Almost there! Now I need to capture your photo for biometric verification. This helps us ensure account security. Please position your face clearly in the camera frame and click capture. 📸",
+    
+    "additional_info": "Great! Your identity is verified. Now I need some additional information to complete your profile. This helps us provide better services tailored to your needs. 📋",
+    
+    "esign": "Final step! Please review your application details and provide your digital signature to complete the account opening process. ✍️",
+    
+    "completion": "🎉 Congratulations! Your account opening is complete! \n\nYour application has been submitted successfully. You'll receive:\n• Account details via SMS/Email within 24 hours\n• Debit card delivery in 3-5 business days\n• Welcome kit with all account information\n\nThank you for choosing us! - Boardy 😊"
+}
+
+_DEFAULT_RESPONSE = "I'm Boardy, and I'm here to help you with your account opening. What would you like to know?"
+
+# Pre-encoded {"message": ...} bodies so chat replies skip JSON encoding per request
+_RESPONSES_BYTES: dict[str, bytes] = {
+    step: ('{"message":' + json.dumps(text) + '}').encode()
+    for step, text in _RESPONSES.items()
+}
+_DEFAULT_RESPONSE_BYTES = ('{"message":' + json.dumps(_DEFAULT_RESPONSE) + '}').encode()
+_ETAGS: dict[str, str] = {
+    step: f'"{hashlib.sha1(body).hexdigest()}"'
+    for step, body in _RESPONSES_BYTES.items()
+}
+PROMPT_CACHE_CONTROL = "public, max-age=3600"
+
 def get_ai_response(step: str, context: dict = None) -> str:
-    responses = {
-        "welcome": "Hi there! I'm Boardy, your personal AI banking assistant! 👋 I'll help you complete your account opening in just a few simple steps. We'll verify your mobile number and email, then complete your KYC process. Ready to get started with me? 🚀",
-        
-        "phone_verification": "Great! Now I need to verify your mobile number. Please enter your 10-digit mobile number, and I'll send you an OTP for verification. 📱",
-        
-        "phone_otp_verification": f"Perfect! I've sent a 6-digit OTP to your mobile number. Please enter the OTP you received. (For demo: use 123456) 🔢",
-        
-        "email_verification": "Excellent! Now let's verify your email address. Please provide your email ID, and I'll send you a verification code. 📧",
-        
-        "email_otp_verification": f"Great! I've sent a 6-digit OTP to your email address. Please check your inbox and enter the OTP you received. (For demo: use 654321) 📧✨",
-        
-        "pan_verification": "Now let's start with your KYC verification. First, I need to verify your PAN card details. Please enter your 10-character PAN number. 🆔",
-        
-        "kyc_document": "Excellent! Your PAN is verified. Now please choose your preferred KYC method:\n\n🪪 **Aadhaar eKYC** - Quick verification using your Aadhaar number\n📄 **DigiLocker** - Upload documents from your DigiLocker\n\nYou can also upload documents directly for verification.",
-        
-        "face_verification": "Almost there! Now I need to capture your photo for biometric verification. This helps us ensure account security. Please position your face clearly in the camera frame and click capture. 📸",
-        
-        "additional_info": "Great! Your identity is verified. Now I need some additional information to complete your profile. This helps us provide better services tailored to your needs. 📋",
-        
-        "esign": "Final step! Please review your application details and provide your digital signature to complete the account opening process. ✍️",
-        
-        "completion": "🎉 Congratulations! Your account opening is complete! \n\nYour application has been submitted successfully. You'll receive:\n• Account details via SMS/Email within 24 hours\n• Debit card delivery in 3-5 business days\n• Welcome kit with all account information\n\nThank you for choosing us! - Boardy 😊"
+    return _RESPONSES.get(step, _DEFAULT_RESPONSE)
+
+async def _advance(session_id: str, step: str, progress: int, extra: dict = None, message: str = None):
+    """Move a session to `step` and post that step's agent prompt.
+
+    The chat message is queued as a plain dict rather than a ChatMessage
+    model, and only once the session update has been written, so a failed
+    update raises without posting the next step's prompt.
+    """
+    fields = {"current_step": step, "progress_percentage": progress}
+    if extra:
+        fields.update(extra)
+    await queue_session_update(session_id, fields)
+    queue_message({
+        "session_id": session_id,
+        "message": message or _RESPONSES[step],
+        "sender": "agent",
+        "timestamp": _now()
+    })
+
+# Fixed verification replies, encoded once and sent as-is
+_PHONE_OTP_SENT = orjson.dumps({"success": True, "message": "OTP sent successfully to your mobile", "otp": "123456"})
+_PHONE_OTP_INVALID = orjson.dumps({"success": False, "message": "Invalid OTP. Please try again."})
+_PHONE_VERIFIED = orjson.dumps({"success": True, "message": "Phone verified successfully!"})
+_EMAIL_OTP_INVALID = orjson.dumps({"success": False, "message": "Invalid email OTP. Please try again."})
+_EMAIL_VERIFIED = orjson.dumps({"success": True, "message": "Email verified successfully! Confirmation sent to your email."})
+_INVALID_VERIFICATION_TYPE = orjson.dumps({"success": False, "message": "Invalid verification type."})
+_EMAIL_OTP_SENT = orjson.dumps({"success": True, "message": "OTP sent successfully to your email!", "otp": "654321"})
+_PAN_INVALID = orjson.dumps({"success": False, "message": "Please enter a valid 10-character PAN number."})
+_PAN_FAILED = orjson.dumps({"success": False, "message": "PAN verification failed. Please check your PAN number and try again."})
+_PAN_VERIFIED = orjson.dumps({"success": True, "message": "PAN verified successfully!"})
+_INVALID_DOCUMENT_TYPE = orjson.dumps({"success": False, "message": "Invalid document type."})
+_FACE_FAILED = orjson.dumps({"success": False, "message": "Face verification failed. Please try again with better lighting."})
+_INFO_SAVED = orjson.dumps({"success": True, "message": "Information saved successfully!"})
+_ONBOARDING_COMPLETED = orjson.dumps({"success": True, "message": "Onboarding completed successfully!"})
+_KYC_FAILED = {
+    doc: orjson.dumps({"success": False, "message": f"{doc.title()} verification failed. Please check your details and try again."})
+    for doc in ("aadhaar", "digilocker")
+}
+_KYC_VERIFIED = {
+    doc: orjson.dumps({"success": True, "message": f"{doc.title()} verified successfully!"})
+    for doc in ("aadhaar", "digilocker")
+}
+_FACE_VERIFIED = {
+    score: orjson.dumps({"success": True, "message": f"Face verification successful! Match score: {score}%"})
+    for score in range(85, 99)
+}
+
+def _json_reply(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+# OTP checks per verification type: expected code, step to advance to, and replies
+_OTP_CONFIG = {
+    "phone": {
+        "code": "123456",
+        "next_step": "email_verification",
+        "progress": 25,
+        "message": get_ai_response("email_verification"),
+        "ok": _PHONE_VERIFIED,
+        "bad": _PHONE_OTP_INVALID
+    },
+    "email": {
+        "code": "654321",
+        "next_step": "pan_verification",
+        "progress": 35,
+        # Also covers the (mock) verification success email
+        "message": "Perfect! Email verified successfully! ✅ I've sent a verification confirmation to your email. " + get_ai_response("pan_verification"),
+        "ok": _EMAIL_VERIFIED,
+        "bad": _EMAIL_OTP_INVALID
     }
-    
-    return responses.get(step, "I'm Boardy, and I'm here to help you with your account opening. What would you like to know?")
+}
 
 # Routes
 @api_router.post("/onboarding/start")
 async def start_onboarding():
     session = OnboardingSession()
-    await db.onboarding_sessions.insert_one(session.dict())
+    await db.onboarding_sessions.insert_one(session.model_dump())
     
     # Create initial chat message
     initial_message = ChatMessage(
@@ -115,289 +369,179 @@ async def start_onboarding():
         message=get_ai_response("welcome"),
         sender="agent"
     )
-    await db.chat_messages.insert_one(initial_message.dict())
+    queue_message(initial_message.model_dump())
     
     return {"session_id": session.id, "message": initial_message.message}
 
 @api_router.get("/onboarding/{session_id}")
 async def get_session(session_id: str):
-    session = await db.onboarding_sessions.find_one({"id": session_id})
+    session = await load_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    # Remove the MongoDB _id field from the response
-    if "_id" in session:
-        del session["_id"]
     return session
 
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison: match `*` or any listed tag, ignoring W/."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+@api_router.get("/onboarding/step/{step}/prompt")
+async def get_step_prompt(step: str, if_none_match: Optional[str] = Header(None)):
+    if step not in _RESPONSES:
+        raise HTTPException(status_code=404, detail="Unknown onboarding step")
+    headers = {"Cache-Control": PROMPT_CACHE_CONTROL, "ETag": _ETAGS[step]}
+    if if_none_match and _etag_matches(if_none_match, _ETAGS[step]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=_RESPONSES_BYTES[step], media_type="application/json", headers=headers)
+
 @api_router.post("/chat")
 async def chat(message: ChatMessage):
-    # Store user message
-    await db.chat_messages.insert_one(message.dict())
-    
-    # Get session
-    session = await db.onboarding_sessions.find_one({"id": message.session_id})
+    # Touch the session and read its step in one Mongo round-trip
+    session = await db.onboarding_sessions.find_one_and_update(
+        {"id": message.session_id},
+        [{"$set": {"updated_at": "$$NOW"}}],
+        projection={"current_step": 1, "_id": 0}
+    )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Generate AI response based on current step
-    ai_response = get_ai_response(session["current_step"])
+    step = session["current_step"]
+    ai_response = get_ai_response(step)
     
-    # Store AI response
+    # Store user message and AI response; queueing is a non-blocking append
     ai_message = ChatMessage(
         session_id=message.session_id,
         message=ai_response,
         sender="agent"
     )
-    await db.chat_messages.insert_one(ai_message.dict())
+    queue_message(message.model_dump())
+    queue_message(ai_message.model_dump())
+    # updated_at changed above; drop the cached copy before replying
+    await invalidate_cached_sessions([message.session_id])
     
-    return {"message": ai_response}
+    return _json_reply(_RESPONSES_BYTES.get(step, _DEFAULT_RESPONSE_BYTES))
 
 @api_router.get("/chat/{session_id}")
 async def get_chat_history(session_id: str):
-    messages = await db.chat_messages.find({"session_id": session_id}).sort("timestamp", 1).to_list(100)
+    cursor = db.chat_messages.find(
+        {"session_id": session_id},
+        projection={"_id": 0, "session_id": 0},
+        batch_size=100
+    ).hint(CHAT_HISTORY_INDEX).sort("timestamp", 1)
+    messages = await cursor.to_list(100)
     return messages
 
 @api_router.post("/verify/phone")
 async def verify_phone(request: VerificationRequest):
     # Mock phone verification
-    await asyncio.sleep(1)  # Simulate API delay
-    
-    # Update session
-    await db.onboarding_sessions.update_one(
-        {"id": request.session_id},
-        {"$set": {
-            "customer_phone": request.phone,
-            "current_step": "phone_otp_verification",
-            "progress_percentage": 15,
-            "updated_at": datetime.utcnow()
-        }}
-    )
+    if _SIMULATE:
+        await asyncio.sleep(_SIMULATE)  # Simulate API delay
     
-    # Create AI response
-    ai_message = ChatMessage(
-        session_id=request.session_id,
-        message=get_ai_response("phone_otp_verification"),
-        sender="agent"
-    )
-    await db.chat_messages.insert_one(ai_message.dict())
+    # Advance the session and send the next prompt
+    await _advance(request.session_id, "phone_otp_verification", 15, extra={"customer_phone": request.phone})
     
-    return {"success": True, "message": "OTP sent successfully to your mobile", "otp": "123456"}
+    return _json_reply(_PHONE_OTP_SENT)
 
 @api_router.post("/verify/otp")
 async def verify_otp(request: VerificationRequest):
     # Mock OTP verification
-    await asyncio.sleep(1)
+    if _SIMULATE:
+        await asyncio.sleep(_SIMULATE)
     
-    # Check verification type and OTP
-    if request.verification_type == "phone":
-        if request.otp != "123456":
-            return {"success": False, "message": "Invalid OTP. Please try again."}
-        
-        # Update session for successful phone verification
-        await db.onboarding_sessions.update_one(
-            {"id": request.session_id},
-            {"$set": {
-                "current_step": "email_verification",
-                "progress_percentage": 25,
-                "updated_at": datetime.utcnow()
-            }}
-        )
-        
-        ai_message = ChatMessage(
-            session_id=request.session_id,
-            message=get_ai_response("email_verification"),
-            sender="agent"
-        )
-        await db.chat_messages.insert_one(ai_message.dict())
-        
-        return {"success": True, "message": "Phone verified successfully!"}
+    config = _OTP_CONFIG.get(request.verification_type)
+    if config is None:
+        return _json_reply(_INVALID_VERIFICATION_TYPE)
+    if request.otp != config["code"]:
+        return _json_reply(config["bad"])
     
-    elif request.verification_type == "email":
-        if request.otp != "654321":
-            return {"success": False, "message": "Invalid email OTP. Please try again."}
-        
-        # Update session for successful email verification
-        await db.onboarding_sessions.update_one(
-            {"id": request.session_id},
-            {"$set": {
-                "current_step": "pan_verification",
-                "progress_percentage": 35,
-                "updated_at": datetime.utcnow()
-            }}
-        )
-        
-        # Send verification success email (mock)
-        ai_message = ChatMessage(
-            session_id=request.session_id,
-            message="Perfect! Email verified successfully! ✅ I've sent a verification confirmation to your email. " + get_ai_response("pan_verification"),
-            sender="agent"
-        )
-        await db.chat_messages.insert_one(ai_message.dict())
-        
-        return {"success": True, "message": "Email verified successfully! Confirmation sent to your email."}
+    # Advance the session for successful verification
+    await _advance(request.session_id, config["next_step"], config["progress"], message=config["message"])
     
-    return {"success": False, "message": "Invalid verification type."}
+    return _json_reply(config["ok"])
 
 @api_router.post("/verify/email")
 async def verify_email(request: VerificationRequest):
     # Mock email verification - send OTP to email
-    await asyncio.sleep(1)
-    
-    await db.onboarding_sessions.update_one(
-        {"id": request.session_id},
-        {"$set": {
-            "customer_email": request.email,
-            "current_step": "email_otp_verification",
-            "progress_percentage": 30,
-            "updated_at": datetime.utcnow()
-        }}
-    )
+    if _SIMULATE:
+        await asyncio.sleep(_SIMULATE)
     
-    ai_message = ChatMessage(
-        session_id=request.session_id,
-        message=get_ai_response("email_otp_verification"),
-        sender="agent"
-    )
-    await db.chat_messages.insert_one(ai_message.dict())
+    await _advance(request.session_id, "email_otp_verification", 30, extra={"customer_email": request.email})
     
-    return {"success": True, "message": "OTP sent successfully to your email!", "otp": "654321"}
+    return _json_reply(_EMAIL_OTP_SENT)
 
 @api_router.post("/kyc/document")
 async def verify_kyc_document(request: KYCDocumentRequest):
     # Mock KYC document verification
-    await asyncio.sleep(2)  # Simulate processing time
+    if _SIMULATE:
+        await asyncio.sleep(_SIMULATE)  # Simulate processing time
     
     # Handle PAN verification
     if request.document_type == "pan":
         if not request.pan_number or len(request.pan_number) != 10:
-            return {"success": False, "message": "Please enter a valid 10-character PAN number."}
+            return _json_reply(_PAN_INVALID)
         
         # Mock PAN verification
-        success = random.choice([True, True, True, False])  # 75% success rate
+        success = _getrb(2) != 0  # 75% success rate
         
         if not success:
-            return {"success": False, "message": "PAN verification failed. Please check your PAN number and try again."}
+            return _json_reply(_PAN_FAILED)
         
-        await db.onboarding_sessions.update_one(
-            {"id": request.session_id},
-            {"$set": {
-                "current_step": "kyc_document",
-                "progress_percentage": 45,
-                "updated_at": datetime.utcnow()
-            }}
-        )
+        await _advance(request.session_id, "kyc_document", 45)
         
-        ai_message = ChatMessage(
-            session_id=request.session_id,
-            message=get_ai_response("kyc_document"),
-            sender="agent"
-        )
-        await db.chat_messages.insert_one(ai_message.dict())
-        
-        return {"success": True, "message": "PAN verified successfully!"}
+        return _json_reply(_PAN_VERIFIED)
     
     # Handle Aadhaar/DigiLocker verification
     elif request.document_type in ["aadhaar", "digilocker"]:
         # Simulate random success/failure for demo
-        success = random.choice([True, True, True, False])  # 75% success rate
+        success = _getrb(2) != 0  # 75% success rate
         
         if not success:
-            return {"success": False, "message": f"{request.document_type.title()} verification failed. Please check your details and try again."}
-        
-        await db.onboarding_sessions.update_one(
-            {"id": request.session_id},
-            {"$set": {
-                "current_step": "face_verification",
-                "progress_percentage": 60,
-                "updated_at": datetime.utcnow()
-            }}
-        )
+            return _json_reply(_KYC_FAILED[request.document_type])
         
-        ai_message = ChatMessage(
-            session_id=request.session_id,
-            message=get_ai_response("face_verification"),
-            sender="agent"
-        )
-        await db.chat_messages.insert_one(ai_message.dict())
+        await _advance(request.session_id, "face_verification", 60)
         
-        return {"success": True, "message": f"{request.document_type.title()} verified successfully!"}
+        return _json_reply(_KYC_VERIFIED[request.document_type])
     
-    return {"success": False, "message": "Invalid document type."}
+    return _json_reply(_INVALID_DOCUMENT_TYPE)
 
 @api_router.post("/verify/biometric")
 async def verify_biometric(request: BiometricRequest):
     # Mock face matching
-    await asyncio.sleep(2)
+    if _SIMULATE:
+        await asyncio.sleep(_SIMULATE)
     
     # Simulate biometric matching
-    match_score = random.randint(85, 98)
+    match_score = 85 + _getrb(4) % 14  # 85-98
     success = match_score >= 85
     
     if not success:
-        return {"success": False, "message": "Face verification failed. Please try again with better lighting."}
-    
-    await db.onboarding_sessions.update_one(
-        {"id": request.session_id},
-        {"$set": {
-            "current_step": "additional_info",
-            "progress_percentage": 80,
-            "updated_at": datetime.utcnow()
-        }}
-    )
+        return _json_reply(_FACE_FAILED)
     
-    ai_message = ChatMessage(
-        session_id=request.session_id,
-        message=get_ai_response("additional_info"),
-        sender="agent"
-    )
-    await db.chat_messages.insert_one(ai_message.dict())
+    await _advance(request.session_id, "additional_info", 80)
     
-    return {"success": True, "message": f"Face verification successful! Match score: {match_score}%"}
+    return _json_reply(_FACE_VERIFIED[match_score])
 
 @api_router.post("/submit/additional-info")
 async def submit_additional_info(request: AdditionalInfoRequest):
-    await asyncio.sleep(1)
-    
-    await db.onboarding_sessions.update_one(
-        {"id": request.session_id},
-        {"$set": {
-            "current_step": "esign",
-            "progress_percentage": 90,
-            "updated_at": datetime.utcnow()
-        }}
-    )
+    if _SIMULATE:
+        await asyncio.sleep(_SIMULATE)
     
-    ai_message = ChatMessage(
-        session_id=request.session_id,
-        message=get_ai_response("esign"),
-        sender="agent"
-    )
-    await db.chat_messages.insert_one(ai_message.dict())
+    await _advance(request.session_id, "esign", 90)
     
-    return {"success": True, "message": "Information saved successfully!"}
+    return _json_reply(_INFO_SAVED)
 
 @api_router.post("/esign")
 async def complete_esign(request: ESignRequest):
-    await asyncio.sleep(2)
-    
-    await db.onboarding_sessions.update_one(
-        {"id": request.session_id},
-        {"$set": {
-            "current_step": "completion",
-            "progress_percentage": 100,
-            "status": "completed",
-            "updated_at": datetime.utcnow()
-        }}
-    )
+    if _SIMULATE:
+        await asyncio.sleep(_SIMULATE)
     
-    ai_message = ChatMessage(
-        session_id=request.session_id,
-        message=get_ai_response("completion"),
-        sender="agent"
-    )
-    await db.chat_messages.insert_one(ai_message.dict())
+    await _advance(request.session_id, "completion", 100, extra={"status": "completed"})
     
-    return {"success": True, "message": "Onboarding completed successfully!"}
+    return _json_reply(_ONBOARDING_COMPLETED)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -417,6 +561,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def warm_db_pool():
+    # Open connections up front so the first request doesn't pay the handshake
+    await db.command("ping")
+
+@app.on_event("startup")
+async def create_indexes():
+    await db.chat_messages.create_index(CHAT_HISTORY_INDEX)
+    await db.onboarding_sessions.create_index([("id", 1)], unique=True)
+
+@app.on_event("startup")
+async def start_flush_loop():
+    global _flush_task, _flushing
+    _flushing = True
+    _flush_task = asyncio.create_task(flush_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    global _flushing
+    _flushing = False
+    if _flush_task:
+        await _flush_task
+    # Write out anything queued after the loop's last pass
+    await flush_pending()
+    await client.close()
+    if _redis is not None:
+        await _redis.aclose()
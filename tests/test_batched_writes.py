@@ -0,0 +1,128 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+import server
+
+
+class StubCollection:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    async def _record(self, *args, **kwargs):
+        self.calls.append(args)
+        if self.error is not None:
+            raise self.error
+
+    insert_many = _record
+    bulk_write = _record
+
+
+@pytest.fixture
+def stub_db(monkeypatch):
+    stub = SimpleNamespace(chat_messages=StubCollection(), onboarding_sessions=StubCollection())
+    monkeypatch.setattr(server, "db", stub)
+    monkeypatch.setattr(server, "_flushing", True)
+    monkeypatch.setattr(server, "_inline_flush", None)
+    for name in ("_pending_msgs", "_pending_updates", "_pending_futures"):
+        monkeypatch.setattr(server, name, [])
+    monkeypatch.setattr(server, "_pending_session_ids", set())
+    return stub
+
+
+def _queue_updates(count):
+    return [server.queue_session_update(f"session-{i}", {"current_step": "esign"}) for i in range(count)]
+
+
+def test_bulk_write_error_fails_only_listed_updates(stub_db):
+    stub_db.onboarding_sessions.error = BulkWriteError({
+        "writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}],
+        "writeConcernErrors": []
+    })
+
+    async def run():
+        futures = _queue_updates(3)
+        await server.flush_pending()
+        return futures
+
+    first, second, third = asyncio.run(run())
+    assert first.result() is None
+    assert third.result() is None
+    assert isinstance(second.exception(), OperationFailure)
+    assert second.exception().code == 11000
+
+
+def test_failed_update_posts_no_agent_message(stub_db):
+    stub_db.onboarding_sessions.error = BulkWriteError({
+        "writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}],
+        "writeConcernErrors": []
+    })
+
+    async def run():
+        tasks = [asyncio.create_task(server._advance(f"session-{i}", "esign", 90)) for i in range(3)]
+        await asyncio.sleep(0)
+        await server.flush_pending()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        await server.flush_pending()
+        return results
+
+    results = asyncio.run(run())
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], OperationFailure)
+    (messages,), = stub_db.chat_messages.calls
+    assert [m["session_id"] for m in messages] == ["session-0", "session-2"]
+
+
+def test_failed_insert_leaves_updates_resolved(stub_db):
+    stub_db.chat_messages.error = RuntimeError("insert failed")
+
+    async def run():
+        server.queue_message({"session_id": "session-0", "message": "hi", "sender": "user"})
+        futures = _queue_updates(2)
+        await server.flush_pending()
+        return futures
+
+    futures = asyncio.run(run())
+    assert len(stub_db.chat_messages.calls) == 1
+    assert [future.result() for future in futures] == [None, None]
+
+
+def test_non_bulk_error_fails_every_update(stub_db):
+    error = RuntimeError("connection reset")
+    stub_db.onboarding_sessions.error = error
+
+    async def run():
+        futures = _queue_updates(3)
+        await server.flush_pending()
+        return futures
+
+    futures = asyncio.run(run())
+    assert all(future.exception() is error for future in futures)
+
+
+def test_update_resolves_inline_without_flush_loop(stub_db, monkeypatch):
+    monkeypatch.setattr(server, "_flushing", False)
+
+    async def run():
+        future = server.queue_session_update("session-0", {"current_step": "esign"})
+        await asyncio.wait_for(future, timeout=1)
+
+    asyncio.run(run())
+    assert len(stub_db.onboarding_sessions.calls) == 1
+    assert server._pending_updates == []
+
+
+def test_update_wraps_values_in_literal(stub_db):
+    async def run():
+        server.queue_session_update("session-0", {"customer_phone": "$x", "progress_percentage": 15})
+
+    asyncio.run(run())
+    assert server._pending_updates == [UpdateOne({"id": "session-0"}, [{"$set": {
+        "customer_phone": {"$literal": "$x"},
+        "progress_percentage": {"$literal": 15},
+        "updated_at": "$$NOW"
+    }}])]
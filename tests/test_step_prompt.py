@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+ETAG = server._ETAGS["welcome"]
+
+
+@pytest.mark.parametrize("if_none_match", [
+    ETAG,
+    f"W/{ETAG}",
+    f'"other", {ETAG}',
+    "*",
+])
+def test_etag_matches(if_none_match):
+    assert server._etag_matches(if_none_match, ETAG)
+
+
+def test_etag_does_not_match_other_tags():
+    assert not server._etag_matches('"other", W/"stale"', ETAG)
+
+
+def test_prompt_not_modified_for_matching_etag():
+    response = asyncio.run(server.get_step_prompt("welcome", if_none_match=ETAG))
+    assert response.status_code == 304
+    assert response.headers["etag"] == ETAG
+
+
+def test_unknown_step_prompt_is_404():
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(server.get_step_prompt("no_such_step", if_none_match=None))
+    assert excinfo.value.status_code == 404